@@ -133,7 +133,7 @@ def test_causal_lm_generate_token(default_bloom, default_bloom_batch):
     )
     assert all([generation.generated_text is None for generation in generations])
     assert all([len(generation.prefill_tokens) == 1 for generation in generations])
-    assert all([generation.token_id.item() == 10264 for generation in generations])
+    assert all([generation.token_id == 10264 for generation in generations])
     assert all([generation.token_text == "Test" for generation in generations])
     assert generations[0].request_id == 0
 
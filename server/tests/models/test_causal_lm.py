@@ -129,7 +129,7 @@ def test_causal_lm_generate_token(default_causal_lm, default_causal_lm_batch):
     )
     assert all([generation.generated_text is None for generation in generations])
     assert all([len(generation.prefill_tokens) == 1 for generation in generations])
-    assert all([generation.token_id.item() == 13 for generation in generations])
+    assert all([generation.token_id == 13 for generation in generations])
     assert all([generation.token_text == "." for generation in generations])
     assert generations[0].request_id == 0
 
@@ -1,8 +1,12 @@
+import json
 import pytest
 import torch
+
+from types import SimpleNamespace
+
 from text_generation_server.pb import generate_pb2
-from text_generation_server.models.causal_lm import CausalLMBatch
-from text_generation_server.models.ct2_causal_lm import CT2CausalLM
+from text_generation_server.models import ct2_causal_lm
+from text_generation_server.models.ct2_causal_lm import CT2CausalLM, CT2CausalLMBatch
 
 
 @pytest.fixture(scope="session")
@@ -44,8 +48,71 @@ def default_fim_pb_batch(default_fim_pb_request):
     return generate_pb2.Batch(id=0, requests=[default_fim_pb_request], size=1)
 
 
+@pytest.fixture
+def default_multi_requests_pb_batch(default_pb_request):
+    short_request = generate_pb2.Request()
+    short_request.CopyFrom(default_pb_request)
+    short_request.id = 1
+    long_request = generate_pb2.Request()
+    long_request.CopyFrom(default_pb_request)
+    long_request.id = 2
+    long_request.inputs = "def hello_world():"
+    long_request.stopping_parameters.max_new_tokens = 5
+    return generate_pb2.Batch(id=1, requests=[short_request, long_request], size=2)
+
+
+def assert_ct2_batch_layout(batch):
+    # Every row holds its tokens left aligned and is sized for the remaining generation
+    assert batch.all_input_ids_tensor.shape == (
+        len(batch),
+        batch.max_input_length + batch.padding_right_offset,
+    )
+    assert batch.input_lengths_tensor.tolist() == batch.input_lengths
+    assert batch.max_input_length == max(batch.input_lengths)
+    for i, input_length in enumerate(batch.input_lengths):
+        assert len(batch.all_input_ids[i]) == input_length
+        assert (
+            batch.all_input_ids_tensor[i, :input_length].tolist()
+            == batch.all_input_ids[i]
+        )
+
+
+def test_ct2_batch_right_padded(default_santacoder, default_pb_request):
+    long_request = generate_pb2.Request()
+    long_request.CopyFrom(default_pb_request)
+    long_request.id = 1
+    long_request.inputs = "def hello_world():"
+    pb_batch = generate_pb2.Batch(
+        id=0, requests=[default_pb_request, long_request], size=2
+    )
+
+    batch = CT2CausalLMBatch.from_pb(
+        pb_batch,
+        default_santacoder.tokenizer,
+        default_santacoder.dtype,
+        default_santacoder.device,
+    )
+
+    short_ids = default_santacoder.tokenizer("def")["input_ids"]
+    long_ids = default_santacoder.tokenizer("def hello_world():")["input_ids"]
+
+    assert batch.input_lengths == [len(short_ids), len(long_ids)]
+    assert batch.prefix_offsets == [
+        max(0, len(short_ids) - 5),
+        max(0, len(long_ids) - 5),
+    ]
+    assert batch.read_offsets == [len(short_ids), len(long_ids)]
+    assert batch.all_input_ids_tensor.dtype == torch.int32
+    assert batch.all_input_ids_tensor.shape == (
+        2,
+        len(long_ids) + batch.padding_right_offset,
+    )
+    assert batch.all_input_ids_tensor[0, : len(short_ids)].tolist() == short_ids
+    assert batch.all_input_ids_tensor[1, : len(long_ids)].tolist() == long_ids
+
+
 def test_ct2santa_generate_token_completion(default_santacoder, default_pb_batch):
-    batch = CausalLMBatch.from_pb(
+    batch = CT2CausalLMBatch.from_pb(
         default_pb_batch,
         default_santacoder.tokenizer,
         default_santacoder.dtype,
@@ -72,7 +139,7 @@ def test_ct2santa_generate_token_completion(default_santacoder, default_pb_batch
 def test_fim_ct2santacoder_generate_token_completion(
     default_santacoder, default_fim_pb_batch
 ):
-    batch = CausalLMBatch.from_pb(
+    batch = CT2CausalLMBatch.from_pb(
         default_fim_pb_batch,
         default_santacoder.tokenizer,
         default_santacoder.dtype,
@@ -97,3 +164,189 @@ def test_fim_ct2santacoder_generate_token_completion(
         generations[0].generated_text.generated_tokens
         == batch.stopping_criterias[0].max_new_tokens
     )
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="bfloat16 requires CUDA")
+def test_ct2santa_generate_token_bfloat16(default_pb_batch):
+    model = CT2CausalLM("bigcode/gpt_bigcode-santacoder", dtype=torch.bfloat16)
+    batch = CT2CausalLMBatch.from_pb(
+        default_pb_batch, model.tokenizer, model.dtype, model.device
+    )
+    input_length = batch.input_lengths[0]
+
+    generations, next_batch = model.generate_token(batch)
+
+    assert len(generations) == 1
+    assert next_batch is not None
+    assert next_batch.input_lengths[0] == input_length + 1
+    assert generations[0].request_id == batch.requests[0].id
+
+
+def test_ct2_batch_filter(default_santacoder, default_multi_requests_pb_batch):
+    batch = CT2CausalLMBatch.from_pb(
+        default_multi_requests_pb_batch,
+        default_santacoder.tokenizer,
+        default_santacoder.dtype,
+        default_santacoder.device,
+    )
+    _, batch = default_santacoder.generate_token(batch)
+    long_input_ids = list(batch.all_input_ids[1])
+
+    batch = batch.filter([2])
+
+    assert len(batch) == 1
+    assert batch.requests_idx_mapping == {2: 0}
+    assert batch.all_input_ids == [long_input_ids]
+    assert batch.padding_right_offset == 5 - 1
+    assert_ct2_batch_layout(batch)
+
+    generations, next_batch = default_santacoder.generate_token(batch)
+    assert len(generations) == 1
+    assert next_batch.input_lengths == [len(long_input_ids) + 1]
+    assert next_batch.all_input_ids[0][-1] == generations[0].token_id
+    assert_ct2_batch_layout(next_batch)
+
+
+def test_ct2_batch_concatenate(
+    default_santacoder, default_pb_batch, default_multi_requests_pb_batch
+):
+    next_batch_0 = CT2CausalLMBatch.from_pb(
+        default_pb_batch,
+        default_santacoder.tokenizer,
+        default_santacoder.dtype,
+        default_santacoder.device,
+    )
+    _, next_batch_0 = default_santacoder.generate_token(next_batch_0)
+    _, next_batch_0 = default_santacoder.generate_token(next_batch_0)
+
+    next_batch_1 = CT2CausalLMBatch.from_pb(
+        default_multi_requests_pb_batch,
+        default_santacoder.tokenizer,
+        default_santacoder.dtype,
+        default_santacoder.device,
+    )
+    _, next_batch_1 = default_santacoder.generate_token(next_batch_1)
+
+    all_input_ids = [
+        list(input_ids)
+        for input_ids in next_batch_0.all_input_ids + next_batch_1.all_input_ids
+    ]
+    padding_right_offset = max(
+        next_batch_0.padding_right_offset, next_batch_1.padding_right_offset
+    )
+
+    next_batch = CT2CausalLMBatch.concatenate([next_batch_0, next_batch_1])
+
+    assert len(next_batch) == 3
+    assert next_batch.requests_idx_mapping == {0: 0, 1: 1, 2: 2}
+    assert next_batch.all_input_ids == all_input_ids
+    assert next_batch.input_lengths == [len(ids) for ids in all_input_ids]
+    assert next_batch.padding_right_offset == padding_right_offset
+    assert_ct2_batch_layout(next_batch)
+
+    generations, next_batch = default_santacoder.generate_token(next_batch)
+    assert len(generations) == 3
+    assert next_batch.input_lengths == [len(ids) + 1 for ids in all_input_ids]
+    for input_ids, generation in zip(next_batch.all_input_ids, generations):
+        assert input_ids[-1] == generation.token_id
+    assert_ct2_batch_layout(next_batch)
+
+
+class FakeConverter:
+    calls = []
+
+    def __init__(self, model_id, **kwargs):
+        self.kwargs = kwargs
+
+    def convert(self, output_dir, quantization, **kwargs):
+        FakeConverter.calls.append(quantization)
+        output_dir.mkdir(parents=True)
+        (output_dir / "model.bin").write_bytes(b"")
+
+
+@pytest.fixture
+def fake_ct2(monkeypatch, tmp_path):
+    """CT2CausalLM with ctranslate2, the tokenizer and the HF config stubbed out"""
+    FakeConverter.calls = []
+    fake_ctranslate2 = SimpleNamespace(
+        __version__="4.0.0",
+        get_supported_compute_types=lambda device: {"int8", "int8_float16"},
+        converters=SimpleNamespace(TransformersConverter=FakeConverter),
+        Generator=lambda *args, **kwargs: object(),
+    )
+    monkeypatch.setattr(ct2_causal_lm, "ctranslate2", fake_ctranslate2)
+    monkeypatch.setattr(
+        ct2_causal_lm.AutoTokenizer,
+        "from_pretrained",
+        lambda *args, **kwargs: SimpleNamespace(pad_token_id=0, all_special_ids=[0]),
+    )
+    monkeypatch.setattr(torch.cuda, "is_available", lambda: True)
+    monkeypatch.setenv("TGI_CT2_MODEL_DIR", str(tmp_path))
+
+    config = {}
+
+    def get_config_dict(*args, **kwargs):
+        config["fetched"] = config.get("fetched", 0) + 1
+        return config.get("config_dict", {}), {}
+
+    monkeypatch.setattr(
+        ct2_causal_lm.PretrainedConfig, "get_config_dict", get_config_dict
+    )
+    return config
+
+
+def test_ct2_converts_awq_checkpoint_as_is(fake_ct2, tmp_path):
+    fake_ct2["config_dict"] = {"quantization_config": {"quant_method": "awq"}}
+
+    model = CT2CausalLM("org/model-awq")
+
+    assert model.ct2_compute_type == "int32_float16"
+    assert FakeConverter.calls == [None]
+    (out_dir,) = [p for p in tmp_path.iterdir() if p.is_dir()]
+    assert out_dir.name.startswith("org--model-awq--int32_float16--main--")
+    assert json.loads((out_dir / "meta.json").read_text())["quantization"] is None
+
+
+def test_ct2_converted_model_skips_config(fake_ct2):
+    CT2CausalLM("org/model")
+    assert fake_ct2["fetched"] == 1
+
+    model = CT2CausalLM("org/model")
+
+    assert model.ct2_compute_type == "int8_float16"
+    assert FakeConverter.calls == ["int8_float16"]
+    # The converted model is reused without fetching the config again
+    assert fake_ct2["fetched"] == 1
+
+
+def test_ct2_gptq_checkpoint_error(fake_ct2):
+    fake_ct2["config_dict"] = {"quantization_config": {"quant_method": "gptq"}}
+
+    with pytest.raises(ValueError, match="GPTQ"):
+        CT2CausalLM("org/model-gptq")
+    assert FakeConverter.calls == []
+
+
+def test_ct2_awq_checkpoint_requires_cuda(fake_ct2, monkeypatch):
+    monkeypatch.setattr(torch.cuda, "is_available", lambda: False)
+    fake_ct2["config_dict"] = {"quantization_config": {"quant_method": "awq"}}
+
+    with pytest.raises(ValueError, match="CUDA"):
+        CT2CausalLM("org/model-awq")
+
+
+def test_ct2_awq_checkpoint_requires_ctranslate2_4(fake_ct2, monkeypatch):
+    monkeypatch.setattr(ct2_causal_lm.ctranslate2, "__version__", "3.24.0")
+    fake_ct2["config_dict"] = {"quantization_config": {"quant_method": "awq"}}
+
+    with pytest.raises(ValueError, match="ctranslate2>=4.0"):
+        CT2CausalLM("org/model-awq")
+
+
+def test_ct2_awq_checkpoint_compute_type_conflict(fake_ct2, monkeypatch):
+    monkeypatch.setenv("TGI_CT2_COMPUTE_TYPE", "int8")
+    fake_ct2["config_dict"] = {"quantization_config": {"quant_method": "awq"}}
+
+    with pytest.raises(ValueError, match="TGI_CT2_COMPUTE_TYPE=int8"):
+        CT2CausalLM("org/model-awq")
+    assert FakeConverter.calls == []
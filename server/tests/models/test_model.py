@@ -76,3 +76,51 @@ def test_decode_streaming_chinese_utf8():
         decoded_text += text
 
     assert decoded_text == truth
+
+
+@pytest.mark.private
+def test_decode_tokens_batched():
+    model = get_test_model()
+    truths = ["Hello here, this is a simple test", "我很感谢你的热情"]
+    sequences = [
+        [15043, 1244, 29892, 445, 338, 263, 2560, 1243],
+        [
+            30672,
+            232,
+            193,
+            139,
+            233,
+            135,
+            162,
+            235,
+            179,
+            165,
+            30919,
+            30210,
+            234,
+            134,
+            176,
+            30993,
+        ],
+    ]
+
+    decoded_texts = ["", ""]
+    offsets = [0, 0]
+    token_offsets = [0, 0]
+    for i in range(max(len(sequence) for sequence in sequences)):
+        all_input_ids = [sequence[: i + 1] for sequence in sequences]
+        results = model.decode_tokens(all_input_ids, offsets, token_offsets)
+        # The Rust batch decode matches the per-request decode
+        assert results == [
+            model.decode_token(input_ids, offset, token_offset)
+            for input_ids, offset, token_offset in zip(
+                all_input_ids, offsets, token_offsets
+            )
+        ]
+        for j, (text, offset, token_offset) in enumerate(results):
+            if i < len(sequences[j]):
+                decoded_texts[j] += text
+                offsets[j] = offset
+                token_offsets[j] = token_offset
+
+    assert decoded_texts == truths
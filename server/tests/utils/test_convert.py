@@ -1,10 +1,16 @@
+import time
+
+import pytest
+import torch
+
+from text_generation_server.utils import convert
 from text_generation_server.utils.hub import (
     download_weights,
     weight_hub_files,
     weight_files,
 )
 
-from text_generation_server.utils.convert import convert_files
+from text_generation_server.utils.convert import convert_file, convert_files
 
 
 def test_convert_files():
@@ -19,3 +25,46 @@ def test_convert_files():
     found_st_files = weight_files(model_id)
 
     assert all([p in found_st_files for p in local_st_files])
+
+
+def test_convert_file(tmp_path):
+    pt_file = tmp_path / "pytorch_model.bin"
+    sf_file = tmp_path / "model.safetensors"
+    torch.save({"weight": torch.ones(2, 2)}, pt_file)
+
+    convert_file(pt_file, sf_file, discard_names=[])
+
+    assert sf_file.exists()
+    assert not (tmp_path / "model.safetensors.tmp").exists()
+
+
+def test_convert_file_check_failure(tmp_path, monkeypatch):
+    pt_file = tmp_path / "pytorch_model.bin"
+    sf_file = tmp_path / "model.safetensors"
+    torch.save({"weight": torch.ones(2, 2)}, pt_file)
+    monkeypatch.setattr(
+        convert, "load_file", lambda _: {"weight": torch.zeros(2, 2)}
+    )
+
+    with pytest.raises(RuntimeError):
+        convert_file(pt_file, sf_file, discard_names=[])
+
+    # Neither the unchecked file nor its temporary file are left behind
+    assert not sf_file.exists()
+    assert not (tmp_path / "model.safetensors.tmp").exists()
+
+
+def test_convert_files_raises_first_failure(tmp_path, monkeypatch):
+    def convert_file(pt_file, sf_file, discard_names):
+        if pt_file.name == "slow.bin":
+            time.sleep(0.5)
+            raise RuntimeError("slow failure")
+        raise RuntimeError("fast failure")
+
+    monkeypatch.setenv("TGI_DOWNLOAD_WORKERS", "2")
+    monkeypatch.setattr(convert, "convert_file", convert_file)
+
+    pt_files = [tmp_path / "slow.bin", tmp_path / "fast.bin"]
+    sf_files = [tmp_path / "slow.safetensors", tmp_path / "fast.safetensors"]
+    with pytest.raises(RuntimeError, match="fast failure"):
+        convert_files(pt_files, sf_files, discard_names=[])
@@ -1,5 +1,8 @@
+import time
+
 import pytest
 
+from text_generation_server.utils import hub
 from text_generation_server.utils.hub import (
     weight_hub_files,
     download_weights,
@@ -33,6 +36,29 @@ def test_download_weights():
     assert files == local_files
 
 
+def test_download_weights_keeps_order(monkeypatch):
+    filenames = ["model-1.safetensors", "model-2.safetensors", "model-3.safetensors"]
+    delays = {"model-1.safetensors": 0.3, "model-2.safetensors": 0.1}
+
+    def hf_hub_download(filename, **kwargs):
+        # The last files finish first
+        time.sleep(delays.get(filename, 0))
+        return f"/cache/{filename}"
+
+    monkeypatch.setenv("TGI_DOWNLOAD_WORKERS", "3")
+    monkeypatch.setattr(hub, "try_to_load_from_cache", lambda *args: None)
+    monkeypatch.setattr(hub, "hf_hub_download", hf_hub_download)
+
+    files = download_weights(filenames, "org/model")
+    assert [f.name for f in files] == filenames
+
+
+def test_download_weights_invalid_workers(monkeypatch):
+    monkeypatch.setenv("TGI_DOWNLOAD_WORKERS", "many")
+    with pytest.raises(ValueError, match="TGI_DOWNLOAD_WORKERS"):
+        download_weights(["model.safetensors"], "org/model")
+
+
 def test_weight_files_error():
     with pytest.raises(RevisionNotFoundError):
         weight_files("bigscience/bloom-560m", revision="error")
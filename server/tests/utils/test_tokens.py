@@ -1,7 +1,11 @@
+import torch
+
+from text_generation_server.pb import generate_pb2
 from text_generation_server.utils.tokens import (
     StopSequenceCriteria,
     StoppingCriteria,
     FinishReason,
+    HeterogeneousNextTokenChooser,
 )
 
 
@@ -42,3 +46,32 @@ def test_stopping_criteria_max():
     assert criteria(1, "") == (False, None)
     assert criteria(1, "") == (False, None)
     assert criteria(1, "") == (True, FinishReason.FINISH_REASON_LENGTH)
+
+
+def test_heterogeneous_next_token_chooser_concatenate(default_pb_parameters):
+    sampling_parameters = generate_pb2.NextTokenChooserParameters()
+    sampling_parameters.CopyFrom(default_pb_parameters)
+    sampling_parameters.do_sample = True
+    sampling_parameters.seed = 42
+
+    first = HeterogeneousNextTokenChooser.from_pb(
+        [sampling_parameters], dtype=torch.float32, device=torch.device("cpu")
+    )
+    second = HeterogeneousNextTokenChooser.from_pb(
+        [default_pb_parameters, sampling_parameters],
+        dtype=torch.float32,
+        device=torch.device("cpu"),
+    )
+    # Advance the generators of the in-flight requests
+    first(None, torch.randn(1, 10))
+    second(None, torch.randn(2, 10))
+
+    chooser = HeterogeneousNextTokenChooser.concatenate(
+        [first, second],
+        [sampling_parameters, default_pb_parameters, sampling_parameters],
+    )
+
+    assert chooser.do_sample == [True, False, True]
+    assert chooser.choice.greedy_indices == [1]
+    assert chooser.choice.sampling_mapping[0] is first.choice.sampling_mapping[0]
+    assert chooser.choice.sampling_mapping[2] is second.choice.sampling_mapping[1]
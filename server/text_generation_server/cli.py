@@ -51,6 +51,19 @@ def serve(
             os.getenv("MASTER_PORT", None) is not None
         ), "MASTER_PORT must be set when sharded is True"
 
+    # Downgrade enum into str for easier management later on
+    quantize = None if quantize is None else quantize.value
+    dtype = None if dtype is None else dtype.value
+    # Validate before the (slow) server imports
+    if (
+        dtype is not None
+        and quantize is not None
+        and quantize != Quantization.ct2.value
+    ):
+        raise RuntimeError(
+            "Only 1 can be set between `dtype` and `quantize`, as they both decide how goes the final model."
+        )
+
     # Remove default handler
     logger.remove()
     logger.add(
@@ -71,13 +84,6 @@ def serve(
     if otlp_endpoint is not None:
         setup_tracing(shard=os.getenv("RANK", 0), otlp_endpoint=otlp_endpoint)
 
-    # Downgrade enum into str for easier management later on
-    quantize = None if quantize is None else quantize.value
-    dtype = None if dtype is None else dtype.value
-    if dtype is not None and quantize is not None and quantize != Quantization.ct2:
-        raise RuntimeError(
-            "Only 1 can be set between `dtype` and `quantize`, as they both decide how goes the final model."
-        )
     server.serve(
         model_id, revision, sharded, quantize, dtype, trust_remote_code, uds_path
     )
@@ -154,16 +160,29 @@ def download_weights(
         local_pt_files = utils.download_weights(pt_filenames, model_id, revision)
 
     if auto_convert:
-        logger.warning(
-            f"No safetensors weights found for model {model_id} at revision {revision}. "
-            f"Converting PyTorch weights to safetensors."
-        )
-
         # Safetensors final filenames
         local_st_files = [
             p.parent / f"{p.stem.lstrip('pytorch_')}.safetensors"
             for p in local_pt_files
         ]
+        # Only convert missing files, for instance after an interrupted conversion
+        missing_files = [
+            (pt_file, st_file)
+            for pt_file, st_file in zip(local_pt_files, local_st_files)
+            if not st_file.exists()
+        ]
+        if not missing_files:
+            logger.info("Safetensors weights are already converted. Skipping conversion.")
+            return
+        local_pt_files = [pt_file for pt_file, _ in missing_files]
+        local_st_files = [st_file for _, st_file in missing_files]
+
+        logger.warning(
+            f"No safetensors weights found for model {model_id} at revision {revision}. "
+            f"Converting PyTorch weights to safetensors."
+        )
+
+        # transformers is only imported when a conversion is actually needed
         try:
             from transformers import AutoConfig
             import transformers
@@ -91,7 +91,8 @@ def get_model(
             model_id,
             revision,
             quantize=quantize,
-            dtype=dtype_ct2,
+            # CT2 defaults to int8 when no dtype was explicitly requested
+            dtype=None if dtype_ct2 is None else dtype,
             trust_remote_code=trust_remote_code,
         )
 
@@ -527,7 +527,7 @@ class CausalLM(Model):
 
             # Generated token
             next_token_logprob = logprobs[-1, next_token_id]
-            next_token_id_squeezed = next_token_id.squeeze()
+            next_token_id_squeezed = next_token_id.squeeze().item()
             next_token_text, prefix_offset, read_offset = self.decode_token(
                 all_input_ids[:, 0], prefix_offset, read_offset
             )
@@ -587,7 +587,7 @@ class CausalLM(Model):
                     next_token_id_squeezed,
                     next_token_logprob,
                     next_token_text,
-                    next_token_id_squeezed.item() in self.all_special_ids,
+                    next_token_id_squeezed in self.all_special_ids,
                     generated_text,
                 )
 
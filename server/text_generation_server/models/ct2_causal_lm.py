@@ -21,6 +21,10 @@
 import torch
 import numpy as np
 import os
+import json
+import fcntl
+import hashlib
+import shutil
 import multiprocessing
 from pathlib import Path
 from dataclasses import dataclass
@@ -29,7 +33,7 @@ from huggingface_hub.constants import HUGGINGFACE_HUB_CACHE
 from opentelemetry import trace
 from transformers import (
     AutoTokenizer,
-    AutoConfig,
+    PretrainedConfig,
     PreTrainedTokenizerBase
 )
 from text_generation_server.models.types import (
@@ -47,9 +51,10 @@ from text_generation_server.models.types import (
     GeneratedText,
 )
 from text_generation_server.pb import generate_pb2
-from text_generation_server.utils import NextTokenChooser, StoppingCriteria, Sampling
-
-from text_generation_server.utils import Sampling
+from text_generation_server.utils import (
+    HeterogeneousNextTokenChooser,
+    StoppingCriteria,
+)
 
 try:
     import ctranslate2
@@ -60,28 +65,153 @@ except ImportError:
 tracer = trace.get_tracer(__name__)
 
 
+def _available_cpus() -> int:
+    """Number of CPUs usable by this process, honoring affinity masks and cgroup v2 quotas"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # sched_getaffinity is not available on all platforms
+        cpus = multiprocessing.cpu_count()
+
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+
+    return cpus
+
+
+def _bind_numa_node(node: int):
+    """Restrict this process to the CPUs of a NUMA node.
+    Memory allocated afterwards, like the CT2 weights, is then local to that node."""
+    with open(f"/sys/devices/system/node/node{node}/cpulist") as f:
+        cpulist = f.read().strip()
+
+    cpus = set()
+    for cpu_range in cpulist.split(","):
+        if "-" in cpu_range:
+            start, end = cpu_range.split("-")
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(cpu_range))
+    os.sched_setaffinity(0, cpus)
+
+
+# 4bit AWQ weights packed in int32, float16 for non-quantized layers
+AWQ_COMPUTE_TYPE = "int32_float16"
+
+
+def _ct2_compute_type(device: str, dtype: Optional[torch.dtype]) -> str:
+    """CT2 compute type, from TGI_CT2_COMPUTE_TYPE or the requested dtype"""
+    if os.environ.get("TGI_CT2_COMPUTE_TYPE", None) is not None:
+        ct2_compute_type = os.environ["TGI_CT2_COMPUTE_TYPE"]
+        supported_compute_types = ctranslate2.get_supported_compute_types(device)
+        if ct2_compute_type not in supported_compute_types:
+            raise ValueError(
+                f"TGI_CT2_COMPUTE_TYPE={ct2_compute_type} is not supported by "
+                f"ctranslate2 on {device}, choose one of {supported_compute_types}"
+            )
+        return ct2_compute_type
+    if dtype == torch.float16 and device == "cuda":
+        return "float16"
+    if dtype == torch.bfloat16 and device == "cuda":
+        if torch.cuda.get_device_capability() >= (8, 0):
+            # int8 for int8 layers, bfloat16 for non-quantized layers.
+            # Keeps the bfloat16 range at half the weight bandwidth on Ampere+.
+            return "int8_bfloat16"
+        return "bfloat16"
+    if device == "cpu" and dtype in [torch.float16, torch.bfloat16]:
+        # float16 is not available on CPU
+        # and int16 has no stable implementation
+        return "float32"
+    # default, int8 quantization.
+    if "cuda" in device:
+        # int8 for int8 layers, float16 for non-quantized layers
+        return "int8_float16"
+    # int8 for int8 layers, float32 for non-quantized layers
+    return "int8"
+
+
+def _ct2_awq_compute_type(device: str) -> str:
+    """CT2 compute type of a pre-quantized AWQ checkpoint"""
+    if int(ctranslate2.__version__.split(".")[0]) < 4:
+        raise ValueError(
+            f"AWQ checkpoints require ctranslate2>=4.0, found {ctranslate2.__version__}"
+        )
+    if device != "cuda":
+        raise ValueError("AWQ checkpoints are only supported by ctranslate2 on CUDA")
+    if os.environ.get("TGI_CT2_COMPUTE_TYPE", AWQ_COMPUTE_TYPE) != AWQ_COMPUTE_TYPE:
+        raise ValueError(
+            f"TGI_CT2_COMPUTE_TYPE={os.environ['TGI_CT2_COMPUTE_TYPE']} "
+            f"is not supported for AWQ checkpoints, which run as {AWQ_COMPUTE_TYPE}"
+        )
+    return AWQ_COMPUTE_TYPE
+
+
+def _ct2_out_dir(
+    model_id: str,
+    revision: Optional[str],
+    ct2_compute_type: str,
+    quantization: Optional[str],
+    activation_scales: Optional[str],
+) -> Tuple[Path, Dict]:
+    """Directory of the converted model, and the converter arguments it is keyed by"""
+    conversion_args = {
+        "model_id": model_id,
+        "revision": revision,
+        "quantization": quantization,
+        "activation_scales": None
+        if activation_scales is None
+        else os.path.abspath(activation_scales),
+    }
+    # Revisions and converter arguments get their own directory instead of
+    # overwriting each other
+    conversion_key = hashlib.sha1(
+        json.dumps(conversion_args, sort_keys=True).encode()
+    ).hexdigest()[:12]
+    out_dir_name = "--".join(
+        [
+            model_id.replace("/", "--"),
+            ct2_compute_type,
+            (revision or "main").replace("/", "--"),
+            conversion_key,
+        ]
+    )
+    # TGI_CT2_MODEL_DIR allows to keep converted models on a tmpfs, e.g. /dev/shm
+    out_dir = (
+        Path(
+            os.environ.get(
+                "TGI_CT2_MODEL_DIR", Path(HUGGINGFACE_HUB_CACHE) / "ct2models"
+            )
+        )
+        / out_dir_name
+    )
+    return out_dir, conversion_args
+
+
 @dataclass
 class CT2CausalLMBatch(Batch):
     batch_id: int
     requests: List[generate_pb2.Request]
     requests_idx_mapping: Dict[int, int]
 
-    # Decoder values
-    input_ids: torch.Tensor
-    attention_mask: torch.Tensor
-    position_ids: torch.Tensor
-    past_key_values: Optional[List[Tuple]]
-
     # All tokens
-    all_input_ids: List[torch.Tensor]
+    all_input_ids: List[List[int]]
+    # Right padded int32 tokens fed to CT2, preallocated for all decode steps
+    all_input_ids_tensor: torch.Tensor
 
     # Lengths of all generations present in the batch
     input_lengths: List[int]
+    # Same as input_lengths, int32 on device, as CT2 reads them
+    input_lengths_tensor: torch.Tensor
     prefix_offsets: List[int]
     read_offsets: List[int]
 
     # Generation helpers
-    next_token_choosers: List[NextTokenChooser]
+    next_token_chooser: HeterogeneousNextTokenChooser
     stopping_criterias: List[StoppingCriteria]
 
     # Metadata used for padding
@@ -91,9 +221,6 @@ class CT2CausalLMBatch(Batch):
     # Maximum number of tokens this batch will grow to
     max_tokens: int
 
-    # Past metadata
-    keys_head_dim_last: bool = True
-
     def to_pb(self) -> generate_pb2.CachedBatch:
         return generate_pb2.CachedBatch(
             id=self.batch_id,
@@ -111,7 +238,7 @@ class CT2CausalLMBatch(Batch):
         device: torch.device,
     ) -> "CT2CausalLMBatch":
         inputs = []
-        next_token_choosers = []
+        next_token_chooser_parameters = []
         stopping_criterias = []
         prefix_offsets = []
         read_offsets = []
@@ -124,7 +251,7 @@ class CT2CausalLMBatch(Batch):
         for i, r in enumerate(pb.requests):
             requests_idx_mapping[r.id] = i
             inputs.append(r.inputs)
-            next_token_choosers.append(NextTokenChooser.from_pb(r.parameters, device))
+            next_token_chooser_parameters.append(r.parameters)
             stopping_criteria = StoppingCriteria.from_pb(
                 r.stopping_parameters, tokenizer
             )
@@ -137,31 +264,43 @@ class CT2CausalLMBatch(Batch):
 
         tokenized_inputs = tokenizer(
             inputs,
-            return_tensors="pt",
+            return_tensors="np",
             padding=True,
             return_token_type_ids=False,
             truncation=True,
             max_length=max_truncation,
-        ).to(device)
-        for _ in pb.requests:
-            input_len = tokenized_inputs["input_ids"].shape[1]
-            prefix_offsets.append(input_len - 5)
-            read_offsets.append(input_len)
-
-        input_lengths = tokenized_inputs["attention_mask"].sum(1)
-        max_input_length = input_lengths.max()
-
+        )
         input_ids = tokenized_inputs["input_ids"]
-        # Allocate maximum attention_mask
-        attention_mask = input_ids.new_zeros(
-            (pb.size, max_input_length + padding_right_offset)
+        input_lengths = tokenized_inputs["attention_mask"].sum(1).tolist()
+        max_input_length = max(input_lengths)
+
+        # Tokens of each request without the tokenizer left padding
+        all_input_ids = []
+        for i, input_length in enumerate(input_lengths):
+            all_input_ids.append(input_ids[i, -input_length:].tolist())
+            # Clamp for prompts shorter than the decode window
+            prefix_offsets.append(max(0, input_length - 5))
+            read_offsets.append(input_length)
+
+        # Allocate the CT2 inputs for the whole generation once. CT2 expects the
+        # tokens right padded, while the tokenizer pads on the left.
+        # The rows are copied on the host, the tensor is moved to the device in one copy.
+        all_input_ids_tensor = np.zeros(
+            (pb.size, max_input_length + padding_right_offset), dtype=np.int32
+        )
+        for i, input_length in enumerate(input_lengths):
+            all_input_ids_tensor[i, :input_length] = input_ids[i, -input_length:]
+        all_input_ids_tensor = torch.tensor(
+            all_input_ids_tensor, dtype=torch.int32, device=device
+        )
+        input_lengths_tensor = torch.tensor(
+            input_lengths, dtype=torch.int32, device=device
         )
-        # Copy tokenizer attention_mask into fully allocated attention_mask
-        attention_mask[:, :max_input_length] = tokenized_inputs["attention_mask"]
 
-        position_ids = tokenized_inputs["attention_mask"].long().cumsum(-1) - 1
-        position_ids.masked_fill_(tokenized_inputs["attention_mask"] == 0, 1)
-        all_input_ids = tokenized_inputs["input_ids"].T.split(1, dim=1)
+        # CT2 logits are cast to float32 before sampling, `dtype` is the CT2 weights type
+        next_token_chooser = HeterogeneousNextTokenChooser.from_pb(
+            next_token_chooser_parameters, torch.float32, device
+        )
 
         max_tokens = len(inputs) * (max_input_length + max_decode_tokens)
 
@@ -169,17 +308,15 @@ class CT2CausalLMBatch(Batch):
             batch_id=pb.id,
             requests=pb.requests,
             requests_idx_mapping=requests_idx_mapping,
-            input_ids=input_ids,
-            attention_mask=attention_mask,
-            position_ids=position_ids,
-            past_key_values=None,
-            all_input_ids=list(all_input_ids),
-            input_lengths=input_lengths.tolist(),
+            all_input_ids=all_input_ids,
+            all_input_ids_tensor=all_input_ids_tensor,
+            input_lengths=input_lengths,
+            input_lengths_tensor=input_lengths_tensor,
             prefix_offsets=prefix_offsets,
             read_offsets=read_offsets,
-            next_token_choosers=next_token_choosers,
+            next_token_chooser=next_token_chooser,
             stopping_criterias=stopping_criterias,
-            max_input_length=max_input_length.item(),
+            max_input_length=max_input_length,
             padding_right_offset=padding_right_offset,
             max_tokens=max_tokens,
         )
@@ -202,7 +339,6 @@ class CT2CausalLMBatch(Batch):
         all_input_ids = []
         max_input_length = 0
 
-        next_token_choosers = []
         stopping_criterias = []
 
         total_remaining_decode_tokens = 0
@@ -222,7 +358,6 @@ class CT2CausalLMBatch(Batch):
             input_lengths.append(request_input_length)
             max_input_length = max(max_input_length, request_input_length)
 
-            next_token_choosers.append(self.next_token_choosers[idx])
             stopping_criteria = self.stopping_criterias[idx]
             stopping_criterias.append(stopping_criteria)
             remaining_decode_tokens = (
@@ -233,48 +368,24 @@ class CT2CausalLMBatch(Batch):
                 new_padding_right_offset, remaining_decode_tokens
             )
 
-        # Apply indices to input_ids, attention mask, past key values and other items that need to be cached
-        input_ids = self.input_ids[keep_indices]
-        position_ids = self.position_ids[keep_indices]
-        self.attention_mask = self.attention_mask[
-            keep_indices,
-            -(self.padding_right_offset + max_input_length) : (
-                self.attention_mask.shape[1] - self.padding_right_offset
-            )
-            + new_padding_right_offset,
+        # Slice unused values from the preallocated CT2 inputs
+        all_input_ids_tensor = self.all_input_ids_tensor[
+            keep_indices, : max_input_length + new_padding_right_offset
         ]
-
-        # Ensure that past_key_values tensors can be updated in-place
-        if type(self.past_key_values[0]) == tuple:
-            self.past_key_values = [list(layer) for layer in self.past_key_values]
-
-        # Update tensors in-place to allow incremental garbage collection
-        past_kv_length = max_input_length - 1
-        for layer in self.past_key_values:
-            past_keys, past_values = layer
-            if len(past_keys.shape) == 3:
-                # Force past to be of dim [self_size, num_heads, ...] for easy indexing
-                past_keys = past_keys.view(len(self), -1, *past_keys.shape[-2:])
-                past_values = past_values.view(len(self), -1, *past_values.shape[-2:])
-            if self.keys_head_dim_last:
-                layer[0] = past_keys[keep_indices, :, -past_kv_length:, :]
-            else:
-                layer[0] = past_keys[keep_indices, :, :, -past_kv_length:]
-            del past_keys
-            layer[1] = past_values[keep_indices, :, -past_kv_length:, :]
-            del past_values
+        input_lengths_tensor = self.input_lengths_tensor[keep_indices]
+        next_token_chooser = self.next_token_chooser.filter(keep_indices)
 
         max_tokens = len(request_ids) * max_input_length + total_remaining_decode_tokens
 
         self.requests = requests
         self.requests_idx_mapping = requests_idx_mapping
-        self.input_ids = input_ids
-        self.position_ids = position_ids
         self.all_input_ids = all_input_ids
+        self.all_input_ids_tensor = all_input_ids_tensor
         self.input_lengths = input_lengths
+        self.input_lengths_tensor = input_lengths_tensor
         self.prefix_offsets = prefix_offsets
         self.read_offsets = read_offsets
-        self.next_token_choosers = next_token_choosers
+        self.next_token_chooser = next_token_chooser
         self.stopping_criterias = stopping_criterias
         self.max_input_length = max_input_length
         self.padding_right_offset = new_padding_right_offset
@@ -301,15 +412,13 @@ class CT2CausalLMBatch(Batch):
         prefix_offsets = []
         read_offsets = []
         all_input_ids = []
-        next_token_choosers = []
+        next_token_chooser_parameters = []
         stopping_criterias = []
         max_tokens = 0
 
         # Batch tensors
-        input_ids = None
-        attention_mask = None
-        position_ids = None
-        past_key_values = []
+        all_input_ids_tensor = None
+        input_lengths_tensor = None
 
         # Used for slicing correctly inside the tensors
         # Equivalent to a cumsum on batch sizes
@@ -320,7 +429,7 @@ class CT2CausalLMBatch(Batch):
             prefix_offsets.extend(batch.prefix_offsets)
             read_offsets.extend(batch.read_offsets)
             all_input_ids.extend(batch.all_input_ids)
-            next_token_choosers.extend(batch.next_token_choosers)
+            next_token_chooser_parameters.extend([r.parameters for r in batch.requests])
             stopping_criterias.extend(batch.stopping_criterias)
 
             if i == 0:
@@ -333,59 +442,22 @@ class CT2CausalLMBatch(Batch):
             # Slicing end index for this batch
             end_index = start_index + len(batch)
 
-            # We only concatenate batches that did at least one step
-            # if batch.past_key_values is None:
-            #     raise ValueError("only concatenate prefilled batches")
-
-            # Create empty tensor
-            # input_ids is always of shape [batch_size, 1]
-            # We do not need to pad it
-            if input_ids is None:
-                input_ids = batch.input_ids.new_empty((total_batch_size, 1))
-            # Copy to correct indices
-            input_ids[start_index:end_index] = batch.input_ids
-
             # Create padded tensor
-            if attention_mask is None:
-                attention_mask = batch.attention_mask.new_zeros(
+            if all_input_ids_tensor is None:
+                all_input_ids_tensor = batch.all_input_ids_tensor.new_zeros(
                     (total_batch_size, max_input_length + padding_right_offset),
                 )
-
-            # We need to slice the attention mask to remove padding from previous steps
-            # and to remove unused allocated space
-            left_offset = max_input_length - batch.max_input_length
-            batch_left_offset = (
-                batch.attention_mask.shape[1]
-                - batch.max_input_length
-                - batch.padding_right_offset
-            )
-            attention_mask[
-                start_index:end_index,
-                left_offset:-padding_right_offset,
-            ] = batch.attention_mask[
-                :,
-                batch_left_offset : -batch.padding_right_offset,
-            ]
+            # Tokens are right padded, so every batch is copied to the left
+            all_input_ids_tensor[
+                start_index:end_index, : batch.all_input_ids_tensor.shape[1]
+            ] = batch.all_input_ids_tensor
 
             # Create empty tensor
-            # position_ids is always of shape [batch_size, 1]
-            if position_ids is None:
-                position_ids = batch.position_ids.new_empty((total_batch_size, 1))
-            position_ids[start_index:end_index] = batch.position_ids
-
-            # Shenanigans to get dimensions because BLOOM outputs a past with a different shape
-            # BLOOM Keys:   [batch_size * num_heads, head_dim, seq_length]
-            # BLOOM Values: [batch_size * num_heads, seq_length, head_dim]
-            # And ensure that we can update tensors in-place
-            # if type(batch.past_key_values[0]) == tuple:
-            #     batch.past_key_values = [
-            #         [t.view(len(batch), -1, *t.shape[-2:]) for t in layer]
-            #         for layer in batch.past_key_values
-            #     ]
-            # elif len(batch.past_key_values[0][0].shape) == 3:
-            #     for layer in batch.past_key_values:
-            #         for k, t in enumerate(layer):
-            #             layer[k] = t.view(len(batch), -1, *t.shape[-2:])
+            if input_lengths_tensor is None:
+                input_lengths_tensor = batch.input_lengths_tensor.new_empty(
+                    total_batch_size
+                )
+            input_lengths_tensor[start_index:end_index] = batch.input_lengths_tensor
 
             # Add eventual padding tokens that were added while concatenating
             max_tokens += batch.max_tokens + (
@@ -394,94 +466,25 @@ class CT2CausalLMBatch(Batch):
 
             start_index = end_index
 
-        # first_past_kvs = batches[0].past_key_values
-        # _, num_heads, padded_sequence_length, head_dim = first_past_kvs[0][1].shape
-
-        # padded_past_values_shape = (
-        #     total_batch_size,
-        #     num_heads,
-        #     max_input_length - 1,
-        #     head_dim,
-        # )
-
-        # if batches[0].keys_head_dim_last:
-        #     padded_past_keys_shape = padded_past_values_shape
-        # else:
-        #     # seq_length is last for BLOOM
-        #     padded_past_keys_shape = (
-        #         total_batch_size,
-        #         num_heads,
-        #         head_dim,
-        #         max_input_length - 1,
-        #     )
-
-        # Iterate over attention layers
-        # Concatenate past key values layer by layer to allow incremental garbage collection
-        # for j in range(len(first_past_kvs)):
-        #     padded_past_keys = first_past_kvs[j][0].new_zeros(padded_past_keys_shape)
-        #     start_index = 0
-        #     for batch in batches:
-        #         past_keys = batch.past_key_values[j][0]
-        #         # Clear reference to the original tensor
-        #         batch.past_key_values[j][0] = None
-
-        #         # Slicing end index for this batch
-        #         end_index = start_index + len(batch)
-        #         # We slice the keys to remove the padding from previous batches
-        #         past_seq_len = batch.max_input_length - 1
-        #         if batch.keys_head_dim_last:
-        #             padded_past_keys[
-        #                 start_index:end_index, :, -past_seq_len:, :
-        #             ] = past_keys[:, :, -past_seq_len:, :]
-        #         else:
-        #             # BLOOM case
-        #             padded_past_keys[
-        #                 start_index:end_index, :, :, -past_seq_len:
-        #             ] = past_keys[:, :, :, -past_seq_len:]
-        #         del past_keys
-
-        #         start_index = end_index
-
-        #     padded_past_values = first_past_kvs[j][1].new_zeros(
-        #         padded_past_values_shape
-        #     )
-        #     start_index = 0
-        #     for batch in batches:
-        #         past_values = batch.past_key_values[j][1]
-        #         # Clear reference to the original tensor
-        #         batch.past_key_values[j][1] = None
-
-        #         # Slicing end index for this batch
-        #         end_index = start_index + len(batch)
-        #         # We slice the past values to remove the padding from previous batches
-        #         past_seq_len = batch.max_input_length - 1
-        #         padded_past_values[
-        #             start_index:end_index, :, -past_seq_len:, :
-        #         ] = past_values[:, :, -past_seq_len:, :]
-        #         del past_values
-
-        #         # Update values
-        #         start_index = end_index
-
-        #     past_key_values.append([padded_past_keys, padded_past_values])
+        next_token_chooser = HeterogeneousNextTokenChooser.concatenate(
+            [batch.next_token_chooser for batch in batches],
+            next_token_chooser_parameters,
+        )
 
         return cls(
             batch_id=batches[0].batch_id,
             requests=requests,
             requests_idx_mapping=requests_idx_mapping,
-            input_ids=input_ids,
-            attention_mask=attention_mask,
-            position_ids=position_ids,
-            past_key_values=past_key_values,
             all_input_ids=all_input_ids,
+            all_input_ids_tensor=all_input_ids_tensor,
             input_lengths=input_lengths,
+            input_lengths_tensor=input_lengths_tensor,
             prefix_offsets=prefix_offsets,
             read_offsets=read_offsets,
-            next_token_choosers=next_token_choosers,
+            next_token_chooser=next_token_chooser,
             stopping_criterias=stopping_criterias,
             max_input_length=max_input_length,
             padding_right_offset=padding_right_offset,
-            keys_head_dim_last=batches[0].keys_head_dim_last,
             max_tokens=max_tokens,
         )
 
@@ -522,61 +525,104 @@ class CT2CausalLM(Model):
             )
         else:
             self.ct2_device = "cpu"
+            if os.environ.get("TGI_CT2_NUMA_NODE", None) is not None:
+                _bind_numa_node(int(os.environ["TGI_CT2_NUMA_NODE"]))
             ct2_generator_kwargs["intra_threads"] = int(
                 os.environ.get(
-                    "TGI_CT2_INTRA_THREADS", multiprocessing.cpu_count() // 2
+                    "TGI_CT2_INTRA_THREADS", max(1, _available_cpus() // 2)
                 )
             )
 
-        if dtype == torch.float16 and self.ct2_device == "cuda":
-            ct2_compute_type = "float16"
-        elif dtype == torch.bfloat16 and self.ct2_device == "cuda":
-            ct2_compute_type = "bfloat16"
-        elif self.ct2_device == "cpu" and dtype in [torch.float16, torch.bfloat16]:
-            # float16 is not available on CPU
-            # and int16 has no stable implementation
-            ct2_compute_type = "float32"
-        else:
-            # default, int8 quantization.
-
-            if "cuda" in self.ct2_device:
-                # int8 for int8 layers, float16 for non-quantized layers
-                ct2_compute_type = "int8_float16"
-            else:
-                # int8 for int8 layers, float32 for non-quantized layers
-                ct2_compute_type = "int8"
+        activation_scales = os.environ.get("TGI_CT2_ACTIVATION_SCALES", None)
 
-        # Start CT2 - conversion
-        out_dir = (
-            Path(HUGGINGFACE_HUB_CACHE)
-            / "ct2models" / f"{model_id.replace('/','--')}--{ct2_compute_type}"
+        ct2_compute_type = _ct2_compute_type(self.ct2_device, dtype)
+        out_dir, conversion_args = _ct2_out_dir(
+            model_id,
+            revision,
+            ct2_compute_type,
+            quantization=ct2_compute_type,
+            activation_scales=activation_scales,
+        )
+        # Pre-quantized AWQ checkpoints are converted as-is instead of re-quantized
+        awq_out_dir, awq_conversion_args = _ct2_out_dir(
+            model_id,
+            revision,
+            AWQ_COMPUTE_TYPE,
+            quantization=None,
+            activation_scales=None,
         )
 
-        if not os.path.exists(out_dir / "model.bin"):
-            try:
-                converter = ctranslate2.converters.TransformersConverter(
-                    model_id,
-                    activation_scales=None,
-                    load_as_float16=ct2_compute_type != "bfloat16",
-                    revision=revision,
-                    low_cpu_mem_usage=True,
-                    trust_remote_code=trust_remote_code,
-                )
-                converter.convert(
-                    output_dir=out_dir,
-                    vmap=None,
-                    quantization=ct2_compute_type,
-                    force=True,
+        # A converted model tells whether the checkpoint was pre-quantized,
+        # the HF config is only fetched before a new conversion
+        config_dict = None
+        if os.path.exists(out_dir / "model.bin"):
+            quant_method = None
+        elif os.path.exists(awq_out_dir / "model.bin"):
+            quant_method = "awq"
+        else:
+            config_dict, _ = PretrainedConfig.get_config_dict(
+                model_id, revision=revision, trust_remote_code=trust_remote_code
+            )
+            quant_method = (config_dict.get("quantization_config", None) or {}).get(
+                "quant_method", None
+            )
+
+        if quant_method == "gptq":
+            raise ValueError(
+                f"{model_id} is a GPTQ checkpoint, which ctranslate2 cannot load. "
+                "Use an AWQ checkpoint or the unquantized model with `--quantize ct2`."
+            )
+        if quant_method == "awq":
+            ct2_compute_type = _ct2_awq_compute_type(self.ct2_device)
+            out_dir, conversion_args = awq_out_dir, awq_conversion_args
+
+        # Optional SmoothQuant activation scales, migrating outlier channels
+        # into the adjacent weights before int8 quantization
+        if activation_scales is not None:
+            if "int8" not in ct2_compute_type:
+                raise ValueError(
+                    f"TGI_CT2_ACTIVATION_SCALES requires an int8 compute type, got {ct2_compute_type}"
                 )
-            except Exception as ex:
+            if not os.path.isfile(activation_scales):
                 raise ValueError(
-                    f"conversion with ctranslate2 for {model_id} failed : Error {ex}"
+                    f"TGI_CT2_ACTIVATION_SCALES={activation_scales} is not a file"
                 )
+
+        # Shards of the same model share one conversion: the first one converts
+        # under an exclusive lock, the others wait and then load the result.
+        out_dir.parent.mkdir(parents=True, exist_ok=True)
+        lock_fd = os.open(
+            out_dir.parent / f"{out_dir.name}.lock", os.O_CREAT | os.O_RDWR
+        )
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_SH)
+            if not os.path.exists(out_dir / "model.bin"):
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                # Another shard may have converted while we waited for the lock
+                if not os.path.exists(out_dir / "model.bin"):
+                    self._convert_ct2(
+                        out_dir=out_dir,
+                        trust_remote_code=trust_remote_code,
+                        **conversion_args,
+                    )
+        finally:
+            # Closing the descriptor releases the lock. A published out_dir is
+            # never modified again, so loading it does not need the lock.
+            os.close(lock_fd)
+
         if not os.path.exists(out_dir / "model.bin"):
             raise ValueError(
                 f"no ctranslate2 model for {model_id} found after conversion in {out_dir}"
             )
 
+        # Ask the kernel to read the weights ahead, the Generator then loads them sequentially
+        if hasattr(os, "posix_fadvise"):
+            fd = os.open(out_dir / "model.bin", os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+
         # Start CT2
         self.ct2_model = ctranslate2.Generator(
             str(out_dir),
@@ -585,33 +631,93 @@ class CT2CausalLM(Model):
             **ct2_generator_kwargs,
         )
 
-        class DummyModel(torch.nn.Module):
-            def __init__(self, *args, **kwargs) -> None:
-                super().__init__(*args, **kwargs)
-                self.config = AutoConfig.from_pretrained(
-                    model_id, revision=revision, trust_remote_code=trust_remote_code
-                )
-
-        model = DummyModel()
+        # The weights live in CT2, Model only needs an empty module
+        model = torch.nn.Module()
 
         if tokenizer.pad_token_id is None:
-            if model.config.pad_token_id is not None:
-                tokenizer.pad_token_id = model.config.pad_token_id
-            elif model.config.eos_token_id is not None:
-                tokenizer.pad_token_id = model.config.eos_token_id
+            # Only read the raw config when the tokenizer does not define a pad token
+            if config_dict is None:
+                config_dict, _ = PretrainedConfig.get_config_dict(
+                    model_id, revision=revision, trust_remote_code=trust_remote_code
+                )
+            if config_dict.get("pad_token_id", None) is not None:
+                tokenizer.pad_token_id = config_dict["pad_token_id"]
+            elif config_dict.get("eos_token_id", None) is not None:
+                tokenizer.pad_token_id = config_dict["eos_token_id"]
             elif tokenizer.eos_token_id is not None:
                 tokenizer.pad_token_id = tokenizer.eos_token_id
             else:
                 tokenizer.add_special_tokens({"pad_token": "[PAD]"})
 
+        self.ct2_compute_type = ct2_compute_type
+
+        if "int8" in ct2_compute_type:
+            model_dtype = torch.int8
+        elif ct2_compute_type == "bfloat16":
+            model_dtype = torch.bfloat16
+        elif ct2_compute_type == "float32":
+            model_dtype = torch.float32
+        else:
+            model_dtype = torch.float16
+
         super().__init__(
             model=model,
             tokenizer=tokenizer,
             requires_padding=True,
-            dtype=torch.int8 if "int8" in ct2_compute_type else torch.float16,
+            dtype=model_dtype,
             device=torch.device(self.ct2_device),
         )
 
+    @staticmethod
+    def _convert_ct2(
+        out_dir: Path,
+        model_id: str,
+        revision: Optional[str],
+        quantization: Optional[str],
+        activation_scales: Optional[str],
+        trust_remote_code: bool,
+    ):
+        """Convert into a temporary directory and move it into place once complete"""
+        tmp_dir = out_dir.parent / f"{out_dir.name}.tmp"
+        try:
+            converter = ctranslate2.converters.TransformersConverter(
+                model_id,
+                activation_scales=activation_scales,
+                load_as_float16=quantization is None
+                or "bfloat16" not in quantization,
+                revision=revision,
+                low_cpu_mem_usage=True,
+                trust_remote_code=trust_remote_code,
+            )
+            converter.convert(
+                output_dir=tmp_dir,
+                vmap=None,
+                quantization=quantization,
+                force=True,
+            )
+            # Record what the model was converted from
+            with open(tmp_dir / "meta.json", "w") as f:
+                json.dump(
+                    {
+                        "model_id": model_id,
+                        "revision": revision,
+                        "quantization": quantization,
+                        "activation_scales": activation_scales,
+                        "low_cpu_mem_usage": True,
+                        "ctranslate2_version": ctranslate2.__version__,
+                    },
+                    f,
+                    indent=2,
+                )
+        except Exception as ex:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise ValueError(
+                f"conversion with ctranslate2 for {model_id} failed : Error {ex}"
+            )
+        # Leftovers of an interrupted conversion from before the lock existed
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.replace(tmp_dir, out_dir)
+
     @property
     def batch_type(self) -> Type[CT2CausalLMBatch]:
         return CT2CausalLMBatch
@@ -623,44 +729,138 @@ class CT2CausalLM(Model):
 
     def forward_ct2(
         self,
-        all_input_ids,
-        input_lengths,
-    ) -> Tuple[torch.Tensor, List[Tuple[torch.Tensor, torch.Tensor]]]:
-        # CT2 forward requires a list of list of input tokens ids and lengths
-        ids_input = (
-            torch.nested.to_padded_tensor(
-                torch.nested.nested_tensor(all_input_ids), 1234567
-            )
-            .flatten(1)
-            .to(torch.int32)
-        )
-        # lengths of the padded ids_input, i.e. how often not pad=1234567 is used.
-        lengths = np.array(input_lengths, dtype=np.int32)
+        input_ids: torch.Tensor,
+        input_lengths: torch.Tensor,
+        return_all_logits: bool = False,
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        # CT2 forward requires right padded int32 input ids of shape [batch, max_length]
+        # and their int32 lengths, both on the CT2 device.
+        # input_ids is a column slice of the preallocated batch tensor, so unless the
+        # batch has no room left it is not contiguous and this copies [batch, max_length]
+        # int32 ids. CT2 re-reads the whole sequence every step anyway; passing the full
+        # buffer instead would make it run over the unused right padding.
+        ids_input = input_ids.contiguous()
+        # lengths of the padded ids_input, i.e. how many tokens of each row are used.
+        lengths = input_lengths
 
-        if self.ct2_device == "cuda":
-            lengths = torch.from_numpy(lengths).to(self.ct2_device)
-        elif self.ct2_device == "cpu":
+        if self.ct2_device == "cpu":
+            # zero-copy views
             ids_input = ids_input.numpy()
+            lengths = lengths.numpy()
 
         ids_input = ctranslate2.StorageView.from_array(ids_input)
         lengths = ctranslate2.StorageView.from_array(lengths)
         # now, forward through the network
         logits = self.ct2_model.forward_batch(ids_input, lengths)
+        if "bfloat16" in self.ct2_compute_type:
+            # bfloat16 is not supported by the CT2 array interface
+            logits = logits.to(ctranslate2.DataType.float32)
 
-        # continue with logits as torch tensor
+        # continue with logits as torch tensor, both are zero-copy views on the CT2 output
         if self.ct2_device == "cpu":
             # logits is a float32 torch cpu tensor
             logits = torch.from_numpy(np.asarray(logits))
         else:
-            # logits is a float16 torch cuda tensor
+            # logits is a float16 or float32 torch cuda tensor
             logits = torch.as_tensor(logits, device=self.ct2_device)
-        return logits, None
+
+        # Inputs are right padded: the last token of each request is at input_length - 1.
+        # Only these [batch, vocab] logits are kept unless all positions are requested.
+        batch_indices = torch.arange(logits.shape[0], device=logits.device)
+        next_token_logits = logits[batch_indices, input_lengths.long() - 1]
+
+        if return_all_logits:
+            return next_token_logits, logits
+        return next_token_logits, None
 
     @tracer.start_as_current_span("generate_token")
     def generate_token(
         self, batch: CT2CausalLMBatch
     ) -> Tuple[List[Generation], Optional[CT2CausalLMBatch]]:
-        logits, past = self.forward_ct2(batch.all_input_ids, batch.input_lengths)
+        # Rows of the requests asking for prefill logprobs on this (prefill) step
+        prefill_logprobs_rows = [
+            i
+            for i, (request, stopping_criteria) in enumerate(
+                zip(batch.requests, batch.stopping_criterias)
+            )
+            if request.prefill_logprobs and stopping_criteria.current_tokens == 0
+        ]
+        compute_prefill_logprobs = len(prefill_logprobs_rows) > 0
+
+        next_token_logits, logits = self.forward_ct2(
+            batch.all_input_ids_tensor[:, : batch.max_input_length],
+            batch.input_lengths_tensor,
+            return_all_logits=compute_prefill_logprobs,
+        )
+
+        # Only the watermark and repetition processors read the previous tokens,
+        # skip the int64 copy of the whole batch history when neither is used
+        if (
+            batch.next_token_chooser.watermark_processor is not None
+            or batch.next_token_chooser.repetition_processor is not None
+        ):
+            chooser_input_ids = batch.all_input_ids_tensor[
+                :, : batch.max_input_length
+            ].long()
+            # Repeat the last token of each request over its right padding,
+            # so that the processors never see the pad id 0
+            positions = torch.arange(
+                batch.max_input_length, device=chooser_input_ids.device
+            )
+            last_token_ids = chooser_input_ids.gather(
+                1, batch.input_lengths_tensor.long().unsqueeze(1) - 1
+            )
+            chooser_input_ids = torch.where(
+                positions.unsqueeze(0) < batch.input_lengths_tensor.unsqueeze(1),
+                chooser_input_ids,
+                last_token_ids,
+            )
+        else:
+            chooser_input_ids = None
+
+        # Sampling runs in float32, whatever the CT2 compute type
+        next_input_ids, next_token_logprobs = batch.next_token_chooser(
+            chooser_input_ids, next_token_logits.float()
+        )
+
+        prefill_logprobs = {}
+        if compute_prefill_logprobs:
+            # Only the requesting rows, up to the longest of their prompts
+            rows_max_length = max(batch.input_lengths[i] for i in prefill_logprobs_rows)
+            rows = torch.tensor(prefill_logprobs_rows, device=logits.device)
+            # Logits at position t score the token at position t + 1.
+            # cross_entropy fuses log_softmax and gather; padded positions are never read.
+            prefill_logprobs_tensor = -torch.nn.functional.cross_entropy(
+                logits[rows, : rows_max_length - 1].transpose(1, 2),
+                batch.all_input_ids_tensor[rows, 1:rows_max_length].long(),
+                reduction="none",
+            )
+            # GPU <-> CPU sync
+            prefill_logprobs = dict(
+                zip(prefill_logprobs_rows, prefill_logprobs_tensor.tolist())
+            )
+        # Release the full logits as early as possible
+        del logits
+
+        # Append next token to all tokens
+        batch_indices = torch.arange(len(batch), device=next_input_ids.device)
+        batch.all_input_ids_tensor[
+            batch_indices, batch.input_lengths_tensor.long()
+        ] = next_input_ids.to(torch.int32)
+        batch.input_lengths_tensor += 1
+
+        # GPU <-> CPU sync
+        next_token_logprobs = next_token_logprobs.tolist()
+        next_token_ids = next_input_ids.tolist()
+
+        # Append next token to all tokens
+        for all_input_ids, next_token_id in zip(batch.all_input_ids, next_token_ids):
+            all_input_ids.append(next_token_id)
+
+        # Detokenize the new tokens of all requests at once
+        decoded_tokens = self.decode_tokens(
+            batch.all_input_ids, batch.prefix_offsets, batch.read_offsets
+        )
 
         # Results
         generations: List[Generation] = []
@@ -670,44 +870,32 @@ class CT2CausalLM(Model):
         iterator = zip(
             batch.requests,
             batch.input_lengths,
-            batch.prefix_offsets,
-            batch.read_offsets,
-            logits,
-            batch.next_token_choosers,
+            decoded_tokens,
             batch.stopping_criterias,
             batch.all_input_ids,
+            batch.next_token_chooser.do_sample,
+            batch.next_token_chooser.seeds,
+            next_token_ids,
+            next_token_logprobs,
         )
 
         # For each member of the batch
         for i, (
             request,
             input_length,
-            prefix_offset,
-            read_offset,
-            logits,
-            next_token_chooser,
+            (next_token_text, prefix_offset, read_offset),
             stopping_criteria,
             all_input_ids,
+            do_sample,
+            seed,
+            next_token_id,
+            next_token_logprob,
         ) in enumerate(iterator):
-            # Select next token
-            next_token_id, logprobs = next_token_chooser(
-                all_input_ids.view(1, -1), logits[-1:, :]
-            )
-
-            # Append next token to all tokens
-            all_input_ids = torch.cat([all_input_ids, next_token_id])
             new_input_length = input_length + 1
 
-            # Generated token
-            next_token_logprob = logprobs[-1, next_token_id]
-            next_token_id_squeezed = next_token_id.squeeze()
-            next_token_text, prefix_offset, read_offset = self.decode_token(
-                all_input_ids[:, 0], prefix_offset, read_offset
-            )
-
             # Evaluate stopping criteria
             stop, reason = stopping_criteria(
-                next_token_id_squeezed,
+                next_token_id,
                 next_token_text,
             )
 
@@ -720,16 +908,13 @@ class CT2CausalLM(Model):
                 if stop:
                     # Decode generated tokens
                     output_text = self.decode(
-                        all_input_ids[-stopping_criteria.current_tokens :, 0]
+                        all_input_ids[-stopping_criteria.current_tokens :]
                     )
-                    # Get seed
-                    if isinstance(next_token_chooser.choice, Sampling):
-                        seed = next_token_chooser.choice.seed
-                    else:
-                        seed = None
-
                     generated_text = GeneratedText(
-                        output_text, stopping_criteria.current_tokens, reason, seed
+                        output_text,
+                        stopping_criteria.current_tokens,
+                        reason,
+                        seed if do_sample else None,
                     )
                 else:
                     generated_text = None
@@ -737,20 +922,17 @@ class CT2CausalLM(Model):
                 # Prefill
                 if stopping_criteria.current_tokens == 1 and request.prefill_logprobs:
                     # Remove generated token to only have prefill and add nan for first prompt token
-
-                    prefill_logprobs = [float("nan")] + torch.log_softmax(
-                        logits, -1
-                    ).gather(1, all_input_ids[1:]).squeeze(1)[
-                        -new_input_length:-1
-                    ].tolist()
-                    prefill_token_ids = all_input_ids[-new_input_length:-1]
+                    request_prefill_logprobs = [float("nan")] + prefill_logprobs[i][
+                        : input_length - 1
+                    ]
+                    prefill_token_ids = all_input_ids[:-1]
                     prefill_texts = self.tokenizer.batch_decode(
                         prefill_token_ids,
                         clean_up_tokenization_spaces=False,
                         skip_special_tokens=False,
                     )
                     prefill_tokens = PrefillTokens(
-                        prefill_token_ids, prefill_logprobs, prefill_texts
+                        prefill_token_ids, request_prefill_logprobs, prefill_texts
                     )
                 else:
                     prefill_tokens = None
@@ -758,17 +940,16 @@ class CT2CausalLM(Model):
                 generation = Generation(
                     request.id,
                     prefill_tokens,
-                    next_token_id_squeezed,
+                    next_token_id,
                     next_token_logprob,
                     next_token_text,
-                    next_token_id_squeezed.item() in self.all_special_ids,
+                    next_token_id in self.all_special_ids,
                     generated_text,
                 )
 
                 generations.append(generation)
 
             # Update values
-            batch.input_ids[i, 0] = next_token_id
             batch.all_input_ids[i] = all_input_ids
             batch.input_lengths[i] = new_input_length
             batch.prefix_offsets[i] = prefix_offset
@@ -779,18 +960,7 @@ class CT2CausalLM(Model):
         if stopped:
             return generations, None
 
-        # Slice unused values from prefill
-        batch.input_ids = batch.input_ids[:, :1]
-
-        # Update attention_mask as we added a new token to input_ids
-        batch.attention_mask[:, -batch.padding_right_offset] = 1
         # Decrease right offset
         batch.padding_right_offset -= 1
 
-        # Update position_ids
-        batch.position_ids = batch.position_ids[:, -1:] + 1
-
-        # Update past key values
-        batch.past_key_values = past
-
         return generations, batch
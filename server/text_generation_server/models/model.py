@@ -24,7 +24,7 @@ class Model(ABC):
     ):
         self.model = model.eval()
         self.tokenizer = tokenizer
-        self.all_special_ids = set(tokenizer.all_special_ids)
+        self.all_special_ids = frozenset(tokenizer.all_special_ids)
         self.requires_padding = requires_padding
         self.dtype = dtype
         self.device = device
@@ -76,13 +76,72 @@ class Model(ABC):
             all_input_ids[prefix_offset:], skip_special_tokens=False
         )
 
+        return self._new_token_text(
+            prefix_text, new_text, len(all_input_ids), prefix_offset, read_offset
+        )
+
+    def decode_tokens(
+        self,
+        all_input_ids: List[List[int]],
+        prefix_offsets: List[int],
+        read_offsets: List[int],
+    ) -> List[Tuple[str, int, int]]:
+        """decode_token for a whole batch, with a single call into the fast tokenizer"""
+        if not self.tokenizer.is_fast:
+            return [
+                self.decode_token(input_ids, prefix_offset, read_offset)
+                for input_ids, prefix_offset, read_offset in zip(
+                    all_input_ids, prefix_offsets, read_offsets
+                )
+            ]
+
+        prefix_slices = [
+            input_ids[prefix_offset:read_offset]
+            for input_ids, prefix_offset, read_offset in zip(
+                all_input_ids, prefix_offsets, read_offsets
+            )
+        ]
+        new_slices = [
+            input_ids[prefix_offset:]
+            for input_ids, prefix_offset in zip(all_input_ids, prefix_offsets)
+        ]
+        # PreTrainedTokenizerBase.batch_decode loops over decode in Python,
+        # the Rust tokenizer decodes the whole batch at once
+        texts = self.tokenizer._tokenizer.decode_batch(
+            prefix_slices + new_slices, skip_special_tokens=False
+        )
+        # Same post-processing as PreTrainedTokenizerFast.decode
+        if self.tokenizer.clean_up_tokenization_spaces:
+            texts = [self.tokenizer.clean_up_tokenization(text) for text in texts]
+
+        return [
+            self._new_token_text(
+                prefix_text, new_text, len(input_ids), prefix_offset, read_offset
+            )
+            for input_ids, prefix_offset, read_offset, prefix_text, new_text in zip(
+                all_input_ids,
+                prefix_offsets,
+                read_offsets,
+                texts[: len(all_input_ids)],
+                texts[len(all_input_ids) :],
+            )
+        ]
+
+    @staticmethod
+    def _new_token_text(
+        prefix_text: str,
+        new_text: str,
+        input_length: int,
+        prefix_offset: int,
+        read_offset: int,
+    ) -> Tuple[str, int, int]:
         if len(new_text) > len(prefix_text) and not new_text.endswith("�"):
             # utf-8 char at the end means it's a potential unfinished byte sequence
             # from byte fallback tokenization.
             # If it's in the middle, it's probably a real invalid id generated
             # by the model
             new_text = new_text[len(prefix_text) :]
-            return new_text, read_offset, len(all_input_ids)
+            return new_text, read_offset, input_length
         else:
             return "", prefix_offset, read_offset
 
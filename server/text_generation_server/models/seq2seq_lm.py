@@ -655,13 +655,15 @@ class Seq2SeqLM(Model):
 
             # Generated token
             next_token_logprob = logprobs[-1, next_token_id]
-            next_token_id_squeezed = next_token_id.squeeze()
+            next_token_id_squeezed = next_token_id.squeeze().item()
             next_token_text, prefix_offset, read_offset = self.decode_token(
                 all_decoder_input_ids, prefix_offset, read_offset
             )
 
             # Evaluate stopping criteria
-            stop, reason = stopping_criteria(next_token_id, next_token_text)
+            stop, reason = stopping_criteria(
+                next_token_id_squeezed, next_token_text
+            )
 
             if not stop:
                 stopped = False
@@ -704,7 +706,7 @@ class Seq2SeqLM(Model):
                     next_token_id_squeezed,
                     next_token_logprob,
                     next_token_text,
-                    next_token_id_squeezed.item() in self.all_special_ids,
+                    next_token_id_squeezed in self.all_special_ids,
                     generated_text,
                 )
 
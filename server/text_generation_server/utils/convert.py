@@ -2,12 +2,15 @@ import datetime
 import torch
 import os
 
+from concurrent.futures import ThreadPoolExecutor
 from loguru import logger
 from pathlib import Path
 from safetensors.torch import save_file, load_file, _find_shared_tensors, _is_complete
 from typing import List, Dict
 from collections import defaultdict
 
+from text_generation_server.utils.hub import as_completed_or_cancel, download_workers
+
 
 def _remove_duplicate_names(
     state_dict: Dict[str, torch.Tensor],
@@ -78,13 +81,21 @@ def convert_file(pt_file: Path, sf_file: Path, discard_names: List[str]):
 
     dirname = os.path.dirname(sf_file)
     os.makedirs(dirname, exist_ok=True)
-    save_file(loaded, sf_file, metadata=metadata)
-    reloaded = load_file(sf_file)
-    for k in loaded:
-        pt_tensor = loaded[k]
-        sf_tensor = reloaded[k]
-        if not torch.equal(pt_tensor, sf_tensor):
-            raise RuntimeError(f"The output tensors do not match for key {k}")
+    # Write to a temporary file and only move it into place once checked,
+    # so that an interrupted conversion never leaves a truncated sf_file behind
+    tmp_file = f"{sf_file}.tmp"
+    try:
+        save_file(loaded, tmp_file, metadata=metadata)
+        reloaded = load_file(tmp_file)
+        for k in loaded:
+            pt_tensor = loaded[k]
+            sf_tensor = reloaded[k]
+            if not torch.equal(pt_tensor, sf_tensor):
+                raise RuntimeError(f"The output tensors do not match for key {k}")
+        os.replace(tmp_file, sf_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
 
 
 def convert_files(pt_files: List[Path], sf_files: List[Path], discard_names: List[str]):
@@ -93,16 +104,24 @@ def convert_files(pt_files: List[Path], sf_files: List[Path], discard_names: Lis
     N = len(pt_files)
     # We do this instead of using tqdm because we want to parse the logs with the launcher
 
-    for i, (pt_file, sf_file) in enumerate(zip(pt_files, sf_files)):
-        # Skip blacklisted files
-        if (
-            "arguments" in pt_file.name
-            or "args" in pt_file.name
-            or "training" in pt_file.name
-        ):
-            continue
-
+    def convert_one(pt_file: Path, sf_file: Path) -> datetime.timedelta:
         start = datetime.datetime.now()
         convert_file(pt_file, sf_file, discard_names)
-        elapsed = datetime.datetime.now() - start
-        logger.info(f"Convert: [{i + 1}/{N}] -- Took: {elapsed}")
+        return datetime.datetime.now() - start
+
+    max_workers = max(1, min(download_workers(), N))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for pt_file, sf_file in zip(pt_files, sf_files):
+            # Skip blacklisted files
+            if (
+                "arguments" in pt_file.name
+                or "args" in pt_file.name
+                or "training" in pt_file.name
+            ):
+                continue
+            futures.append(executor.submit(convert_one, pt_file, sf_file))
+
+        for i, future in enumerate(as_completed_or_cancel(futures)):
+            elapsed = future.result()
+            logger.info(f"Convert: [{i + 1}/{N}] -- Took: {elapsed}")
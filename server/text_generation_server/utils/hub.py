@@ -1,10 +1,11 @@
 import time
 import os
 
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import timedelta
 from loguru import logger
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Iterator
 
 from huggingface_hub import HfApi, hf_hub_download
 from huggingface_hub.constants import HUGGINGFACE_HUB_CACHE
@@ -17,6 +18,32 @@ from huggingface_hub.utils import (
 WEIGHTS_CACHE_OVERRIDE = os.getenv("WEIGHTS_CACHE_OVERRIDE", None)
 
 
+def download_workers() -> int:
+    """Number of files downloaded (or converted) concurrently"""
+    value = os.getenv("TGI_DOWNLOAD_WORKERS", "1")
+    try:
+        workers = int(value)
+    except ValueError:
+        workers = 0
+    if workers < 1:
+        raise ValueError(
+            f"TGI_DOWNLOAD_WORKERS must be a positive integer, got {value!r}"
+        )
+    return workers
+
+
+def as_completed_or_cancel(futures: List[Future]) -> Iterator[Future]:
+    """Yield the futures as they complete, cancelling the queued ones on the first failure"""
+    try:
+        for future in as_completed(futures):
+            future.result()
+            yield future
+    except Exception:
+        for future in futures:
+            future.cancel()
+        raise
+
+
 def weight_hub_files(
     model_id: str, revision: Optional[str] = None, extension: str = ".safetensors"
 ) -> List[str]:
@@ -168,15 +195,20 @@ def download_weights(
 
     # We do this instead of using tqdm because we want to parse the logs with the launcher
     start_time = time.time()
-    files = []
-    for i, filename in enumerate(filenames):
-        file = download_file(filename)
-
-        elapsed = timedelta(seconds=int(time.time() - start_time))
-        remaining = len(filenames) - (i + 1)
-        eta = (elapsed / (i + 1)) * remaining if remaining > 0 else 0
-
-        logger.info(f"Download: [{i + 1}/{len(filenames)}] -- ETA: {eta}")
-        files.append(file)
+    files = [None] * len(filenames)
+    max_workers = max(1, min(download_workers(), len(filenames)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(download_file, filename): i
+            for i, filename in enumerate(filenames)
+        }
+        for done, future in enumerate(as_completed_or_cancel(list(futures)), start=1):
+            files[futures[future]] = future.result()
+
+            elapsed = timedelta(seconds=int(time.time() - start_time))
+            remaining = len(filenames) - done
+            eta = (elapsed / done) * remaining if remaining > 0 else 0
+
+            logger.info(f"Download: [{done}/{len(filenames)}] -- ETA: {eta}")
 
     return files
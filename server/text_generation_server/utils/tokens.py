@@ -279,6 +279,29 @@ class HeterogeneousNextTokenChooser:
             dtype=dtype,
         )
 
+    @classmethod
+    def concatenate(
+        cls,
+        choosers: List["HeterogeneousNextTokenChooser"],
+        pb: List[generate_pb2.NextTokenChooserParameters],
+    ) -> "HeterogeneousNextTokenChooser":
+        """Merge choosers, carrying over the generators of in-flight sampled requests"""
+        next_token_chooser = cls.from_pb(
+            pb, dtype=choosers[0].dtype, device=choosers[0].device
+        )
+
+        if isinstance(next_token_chooser.choice, HeterogeneousSampling):
+            start_index = 0
+            for chooser in choosers:
+                if isinstance(chooser.choice, HeterogeneousSampling):
+                    for i, sampling in chooser.choice.sampling_mapping.items():
+                        next_token_chooser.choice.sampling_mapping[
+                            start_index + i
+                        ] = sampling
+                start_index += len(chooser.do_sample)
+
+        return next_token_chooser
+
 
 class Sampling:
     def __init__(self, seed: int, device: str = "cpu"):